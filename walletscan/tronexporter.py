@@ -1,8 +1,13 @@
 from enum import Enum
 import walletscan
-import codecs
-import time
-from datetime import datetime
+import csv
+import functools
+import heapq
+import itertools
+import pytz
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timezone
 
 
 class TransferType(Enum):
@@ -18,15 +23,46 @@ class TransferType(Enum):
     Loss = 'Verlust'
 
 
+class TransferClassificationError(ValueError):
+    """Raised if the transfer type of a transfer cannot be determined."""
+
+
+# Amount divisor of TRX (1 TRX = 1000000 SUN)
+_TRX_DIVISOR = 1000000
+
+# Transfer types which are exported as buy
+_INCOMING_TYPES = frozenset({TransferType.Deposit, TransferType.Revenues,
+                             TransferType.Mining, TransferType.GiftIn})
+
+
+def _intern_address(address: str):
+    """Interns an address like the addresses of parsed transfers. None is kept."""
+    return None if address is None else sys.intern(address)
+
+
+def _parse_ts(date: str):
+    """Converts a UTC date of format "yyyy-mm-dd hh:mm:ss" to a timestamp in milliseconds."""
+    return int(datetime.strptime(date, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _get_token_precision(token_name: str):
+    """Requests the precision of a token."""
+    return walletscan.TronScan.get_token_info(token_name)['data'][0]['precision']
+
+
 class TronTransferExporter(object):
     """Exporter Class for Tron transfers."""
 
+    # Maximum number of parallel token information requests
+    TOKEN_INFO_WORKERS = 16
+
     def __init__(self, wallet_address):
-        self.wallet_address = wallet_address
+        self.wallet_address = sys.intern(wallet_address)
         self.assignments = []
         self.group_filters = []
         self.currency_filters = []
         self.currency_aliases = {}
+        self._divisor_cache = {}
 
     def add_assign(self, transfer_type: TransferType, from_address=None, to_address=None):
         """
@@ -46,7 +82,8 @@ class TronTransferExporter(object):
             return
 
         self.assignments.append({'transfer_type': transfer_type,
-                                 'from_address': from_address, 'to_address': to_address})
+                                 'from_address': _intern_address(from_address),
+                                 'to_address': _intern_address(to_address)})
 
     def add_currency_filter(self, currency: str):
         """
@@ -85,7 +122,8 @@ class TronTransferExporter(object):
             return
 
         self.group_filters.append(
-            {'currency': currency, 'from_address': from_address, 'to_address': to_address})
+            {'currency': currency, 'from_address': _intern_address(from_address),
+             'to_address': _intern_address(to_address)})
 
     def _group_transfers(self, transfers: [walletscan.TronTransfer]):
         """Groups the transfers for merging.
@@ -94,7 +132,7 @@ class TronTransferExporter(object):
             transfers {[TronTransfer]} -- Transfers which will be grouped.
         
         Returns:
-            dict -- Grouped transfers.
+            dict -- Grouped transfers and the ungrouped transfers sorted by time.
         """
         if not self.group_filters:
             return {}, transfers
@@ -103,96 +141,90 @@ class TronTransferExporter(object):
 
         grouped_tr = {}
         ungrouped_tr = []
-        new_group_currenys = []
+        new_group_currenys = set()
+
+        # Index of the first added filter of each address of incoming and outgoing transfers
+        in_addresses = {}
+        out_addresses = {}
+        for index, g_filter in enumerate(self.group_filters):
+            if g_filter['from_address'] is not None:
+                in_addresses.setdefault(g_filter['from_address'], index)
+            if g_filter['to_address'] is not None:
+                out_addresses.setdefault(g_filter['to_address'], index)
+
+        no_filter = len(self.group_filters)
+
         for t in sorted_tr:
-            for g_filter in self.group_filters:
-                is_grouped = False
-
-                # deposit
-                if g_filter['from_address'] is not None and g_filter['from_address'] == t.from_address:
-                    # Add token as a new category, if the category doesn't exist yet
-                    if t.token_name not in grouped_tr:
-                        grouped_tr[t.token_name] = {'count': 0, 'groups': []}
-
-                    # Add new Group, if the token has nos group yet
-                    if grouped_tr[t.token_name]['count'] == 0:
-                        grouped_tr[t.token_name]['groups'].append({'is_outgoing': False,
-                                                                   'address': t.from_address,
-                                                                   'transfers': []})
-                        grouped_tr[t.token_name]['count'] = 1
-
-                    # Current group index
-                    group_index = grouped_tr[t.token_name]['count'] - 1
-
-                    # If the current transfer does not fit into the group, new group will be created
-                    if grouped_tr[t.token_name]['groups'][group_index]['is_outgoing'] or \
-                       grouped_tr[t.token_name]['groups'][group_index]['address'] != t.from_address or \
-                       t.token_name in new_group_currenys:
-
-                        # Add new group
-                        grouped_tr[t.token_name]['groups'].append({'is_outgoing': False,
-                                                                   'address': t.from_address,
-                                                                   'transfers': []})
-
-                        grouped_tr[t.token_name]['count'] += 1
-                        group_index = grouped_tr[t.token_name]['count'] - 1
-                        if t.token_name in new_group_currenys:
-                            new_group_currenys.remove(t.token_name)
-
-                    # Add transfer to group
-                    grouped_tr[t.token_name]['groups'][group_index]['transfers'].append(
-                        t)
-                    is_grouped = True
-                    break
-
-                # withdrawal
-                elif g_filter['to_address'] is not None and g_filter['to_address'] == t.to_address:
-                     # Add token as a new category, if the category doesn't exist yet
-                    if t.token_name not in grouped_tr:
-                        grouped_tr[t.token_name] = {'count': 0, 'groups': []}
-
-                    # Add new Group, if the token has nos group yet
-                    if grouped_tr[t.token_name]['count'] == 0:
-                        grouped_tr[t.token_name]['groups'].append({'is_outgoing': True,
-                                                                   'address': t.to_address,
-                                                                   'transfers': []})
-                        grouped_tr[t.token_name]['count'] = 1
-
-                    # Current group index
-                    group_index = grouped_tr[t.token_name]['count'] - 1
-
-                    # If the current transfer does not fit into the group, new group will be created
-                    if grouped_tr[t.token_name]['groups'][group_index]['is_outgoing'] or \
-                       grouped_tr[t.token_name]['groups'][group_index]['address'] != t.to_address or \
-                       t.token_name in new_group_currenys:
-
-                        # Add new group
-                        grouped_tr[t.token_name]['groups'].append({'is_outgoing': True,
-                                                                   'address': t.to_address,
-                                                                   'transfers': []})
-
-                        grouped_tr[t.token_name]['count'] += 1
-                        group_index = grouped_tr[t.token_name]['count'] - 1
-                        if t.token_name in new_group_currenys:
-                            new_group_currenys.remove(t.token_name)
-
-                    # Add transfer to group
-                    grouped_tr[t.token_name]['groups'][group_index]['transfers'].append(
-                        t)
-                    is_grouped = True
-                    break
+            is_grouped = False
+
+            # The first added filter matching the transfer wins, the sender is checked first within a filter
+            in_index = in_addresses.get(t.from_address, no_filter)
+            out_index = out_addresses.get(t.to_address, no_filter)
+
+            # deposit
+            if in_index < no_filter and in_index <= out_index:
+                # Add token as a new category, if the category doesn't exist yet
+                token_groups = grouped_tr.get(t.token_name)
+                if token_groups is None:
+                    token_groups = grouped_tr[t.token_name] = []
+
+                # Current group, if the token has a group yet
+                cur_group = token_groups[-1] if token_groups else None
+
+                # If the token has no group yet or the current transfer does not fit into the group, new group will be created
+                if cur_group is None or \
+                   cur_group['is_outgoing'] or \
+                   cur_group['address'] != t.from_address or \
+                   t.token_name in new_group_currenys:
+
+                    # Add new group
+                    cur_group = {'is_outgoing': False,
+                                 'address': t.from_address,
+                                 'transfers': []}
+                    token_groups.append(cur_group)
+
+                    new_group_currenys.discard(t.token_name)
+
+                # Add transfer to group
+                cur_group['transfers'].append(t)
+                is_grouped = True
+
+            # withdrawal
+            elif out_index < no_filter:
+                # Add token as a new category, if the category doesn't exist yet
+                token_groups = grouped_tr.get(t.token_name)
+                if token_groups is None:
+                    token_groups = grouped_tr[t.token_name] = []
+
+                # Current group, if the token has a group yet
+                cur_group = token_groups[-1] if token_groups else None
+
+                # If the token has no group yet or the current transfer does not fit into the group, new group will be created
+                if cur_group is None or \
+                   not cur_group['is_outgoing'] or \
+                   cur_group['address'] != t.to_address or \
+                   t.token_name in new_group_currenys:
+
+                    # Add new group
+                    cur_group = {'is_outgoing': True,
+                                 'address': t.to_address,
+                                 'transfers': []}
+                    token_groups.append(cur_group)
+
+                    new_group_currenys.discard(t.token_name)
+
+                # Add transfer to group
+                cur_group['transfers'].append(t)
+                is_grouped = True
 
             if not is_grouped:
-                if t.token_name in grouped_tr and t.token_name not in new_group_currenys:
-                    new_group_currenys.append(t.token_name)
+                if t.token_name in grouped_tr:
+                    new_group_currenys.add(t.token_name)
 
                 # Add transfer to the not grouped
                 ungrouped_tr.append(t)
 
-        groups = []
-        for _, value in grouped_tr.items():
-            for g_filter in value['groups']:
-                groups.append(g_filter['transfers'])
+        groups = [g['transfers'] for g in itertools.chain.from_iterable(grouped_tr.values())]
 
         return groups, ungrouped_tr
 
@@ -211,27 +243,98 @@ class TronTransferExporter(object):
 
         groups, trs = self._group_transfers(transfers)
 
+        # No transfer matched a group, ungrouped transfers are already sorted
+        if not groups:
+            return trs
+
+        # ToDo localisation
+        tz = pytz.timezone('Europe/Berlin')
+
+        merged_trs = []
         for g in groups:
-            transfer = walletscan.TronTransfer()
-            transfer.amount = 0
-            transfer.from_address = g[0].from_address
-            transfer.to_address = g[0].to_address
-            transfer.token_name = g[0].token_name
-            transfer.confirmed = True
-
-            for t in g:
-                transfer.timestamp = t.timestamp
-                transfer.amount += t.amount
-                transfer.confirmed &= g[0].confirmed
-
-            # ToDo localisation
+            # Groups are sorted by time, the last transfer dates the merged one
+            transfer = walletscan.TronTransfer(timestamp=g[-1].timestamp,
+                                               from_address=g[0].from_address,
+                                               to_address=g[0].to_address,
+                                               amount=sum(t.amount for t in g),
+                                               token_name=g[0].token_name,
+                                               confirmed=all(t.confirmed for t in g))
+
             transfer.comment = 'Grouped ' + \
-                g[0].get_date(timezone='Europe/Berlin') + ' - ' + transfer.get_date(timezone='Europe/Berlin')
-            trs.append(transfer)
+                g[0].get_date(timezone=tz) + ' - ' + transfer.get_date(timezone=tz)
+            merged_trs.append(transfer)
+
+        # Ungrouped transfers are already sorted by time
+        merged_trs.sort(key=lambda x: x.timestamp)
 
-        trs.sort(key=lambda x: x.timestamp)
+        return list(heapq.merge(trs, merged_trs, key=lambda x: x.timestamp))
 
-        return trs
+    def _classify_transfers(self, transfers: [walletscan.TronTransfer]):
+        """
+        Determines the transfer types of the transfers in one pass. Transfers without assignment
+        are declared as deposits or withdrawals.
+
+        Arguments:
+            transfers {[TronTransfer]} -- Transfers which will be classified.
+
+        Returns:
+            [TransferType] -- Transfer type of each transfer.
+
+        Raises:
+            TransferClassificationError -- A transfer has no assignment and does not affect the wallet.
+        """
+
+        # Index and type of the first added assignment of each address
+        from_assigns = {}
+        to_assigns = {}
+        for index, assign in enumerate(self.assignments):
+            if assign['from_address'] is not None:
+                from_assigns.setdefault(assign['from_address'], (index, assign['transfer_type']))
+            if assign['to_address'] is not None:
+                to_assigns.setdefault(assign['to_address'], (index, assign['transfer_type']))
+
+        no_assign = (len(self.assignments), None)
+
+        tr_types = []
+        for tr in transfers:
+            # The first added assignment matching the sender or the destination wins
+            from_assign = from_assigns.get(tr.from_address, no_assign)
+            to_assign = to_assigns.get(tr.to_address, no_assign)
+            tr_type = (from_assign if from_assign[0] <= to_assign[0] else to_assign)[1]
+
+            if tr_type is None:
+                if tr.to_address == self.wallet_address:
+                    tr_type = TransferType.Deposit
+
+                elif tr.from_address == self.wallet_address:
+                    tr_type = TransferType.Withdrawal
+
+                else:
+                    raise TransferClassificationError(
+                        'Transfer ' + str(tr.id) + ' from ' + str(tr.from_address) + ' to ' + str(tr.to_address) +
+                        ' has no assignment and does not affect the wallet ' + str(self.wallet_address) + '.')
+
+            tr_types.append(tr_type)
+
+        return tr_types
+
+    def _fetch_token_divisors(self, transfers: [walletscan.TronTransfer]):
+        """
+        Fetches the precisions of all tokens of the transfers in parallel and caches their amount divisors.
+        Divisors which are already known will not be fetched again.
+
+        Arguments:
+            transfers {[TronTransfer]} -- Transfers whose token precisions will be fetched.
+        """
+
+        tokens = {t.token_name for t in transfers
+                  if t.token_name != '_' and t.token_name not in self._divisor_cache}
+        if not tokens:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.TOKEN_INFO_WORKERS, len(tokens))) as executor:
+            for token, precision in zip(tokens, executor.map(_get_token_precision, tokens)):
+                self._divisor_cache[token] = 10**precision
 
     def export_csv(self, filename: str, start_date: str = None, end_date: str = None):
         raise NotImplementedError()
@@ -247,116 +350,91 @@ class CoinTrackingExporter(TronTransferExporter):
     def export_csv(self, filename: str, start_date: str = None, end_date: str = None):
         """
         Fetches the transfers from the wallet and exports them to a csv file.
+        Dates of the export are written in UTC like the dates of the range.
 
         Arguments:
             filename {str} -- Destination file.
-            start_date {str} -- Exports all transfers from including this date. Format: "yyyy-mm-dd hh:mm:ss"
-            end_date {str} -- Exports all transfers up to and including this date. Format: "yyyy-mm-dd hh:mm:ss"
+            start_date {str} -- Exports all transfers from including this date (UTC). Format: "yyyy-mm-dd hh:mm:ss"
+            end_date {str} -- Exports all transfers up to and including this date (UTC). Format: "yyyy-mm-dd hh:mm:ss"
         """
 
-        ts_start = None
-        if start_date is not None:
-            ts_start = time.mktime(datetime.strptime(start_date, '%Y-%m-%d %H:%M:%S').timetuple())
-            ts_start = int(ts_start * 1000)
-
-        ts_end = None
-        if end_date is not None:
-            ts_end = time.mktime(datetime.strptime(end_date, '%Y-%m-%d %H:%M:%S').timetuple())
-            ts_end = int(ts_end * 1000)
+        ts_start = None if start_date is None else _parse_ts(start_date)
+        ts_end = None if end_date is None else _parse_ts(end_date)
 
-        print("Fetching transfers from tronscan.org API ...")
+        print("Fetching transfers of " + self.wallet_address + " from tronscan.org API ...")
         scanner = walletscan.TronScan(self.wallet_address)
         transfers = scanner.get_transfers(tokens=self.currency_filters, ts_start=ts_start, ts_end=ts_end)
         ptr = walletscan.TronTransfer.parse_transfers(transfers)
-        print("Fetching success.")
+        self._fetch_token_divisors(ptr)
+        print("Fetching transfers of " + self.wallet_address + " success.")
 
         if self.group_filters:
             print("Merging grouped transfers ...")
             ptr = self._merge_transfers(ptr)
             print("Merging success.")
 
-        print("Writing CSV for CoinTracking.info ...")
-
-        with codecs.open(filename, 'w', 'utf-8') as csvf:
+        tr_types = self._classify_transfers(ptr)
 
-            # ToDo: Switchable language
-            csvf.write(r'"Typ","Kauf","Cur.","Verkauf","Cur.","Gebühr","Cur.","Börse","Gruppe","Kommentar","Datum"')
+        print("Writing CSV " + filename + " for CoinTracking.info ...")
 
-            for tr in ptr:
-                line = '\n'
-                has_assign = False
-                tr_type = TransferType.Deposit
+        exchange = '' if self.wallet_name is None else self.wallet_name
 
-                # Type
-                for assign in self.assignments:
-                    if tr.from_address == assign['from_address'] or tr.to_address == assign['to_address']:
-                        tr_type = assign['transfer_type']
-                        has_assign = True
-                        break
+        # ToDo: Switchable language
+        rows = [('Typ', 'Kauf', 'Cur.', 'Verkauf', 'Cur.', 'Gebühr', 'Cur.', 'Börse', 'Gruppe', 'Kommentar', 'Datum')]
 
-                if not has_assign:
-                    if tr.to_address == self.wallet_address:
-                        tr_type = TransferType.Deposit
+        for tr, tr_type in zip(ptr, tr_types):
+            amount = 0
+            cur = ''
 
-                    elif tr.from_address == self.wallet_address:
-                        tr_type = TransferType.Withdrawal
+            if tr.token_name == '_':
+                amount = tr.amount / _TRX_DIVISOR
+                cur = 'TRX'
+            else:
+                amount = tr.amount / self._divisor_cache[tr.token_name]
+                cur = self.currency_aliases.get(tr.token_name, tr.token_name)
 
-                    else:
-                        print('Something went wrong.')
-                        exit()
+            if tr_type in _INCOMING_TYPES:
 
-                line += '\"' + tr_type.value + '\",'
+                # Buy, Sell
+                buy_amount, buy_cur, sell_amount, sell_cur = amount, cur, '', ''
 
-                amount = 0
-                cur = ''
+            else:
+                # Buy, Sell
+                buy_amount, buy_cur, sell_amount, sell_cur = '', '', amount, cur
 
-                if tr.token_name == '_':
-                    amount = tr.amount / 1000000
-                    cur = 'TRX'
-                else:
-                    token_info = walletscan.TronScan.get_token_info(tr.token_name)
-                    precision = token_info['data'][0]['precision']
-
-                    amount = tr.amount / (10**precision)
-
-                    if tr.token_name in self.currency_aliases:
-                        cur = self.currency_aliases[tr.token_name]
-                    else:
-                        cur = tr.token_name
+            # ToDo: Fee
+            rows.append((tr_type.value, buy_amount, buy_cur, sell_amount, sell_cur, '', '',
+                         exchange, '', tr.comment, tr.get_date(timezone=timezone.utc)))
 
-                if tr_type.value == TransferType.Deposit.value or \
-                   tr_type.value == TransferType.Revenues.value or \
-                   tr_type.value == TransferType.Mining.value or \
-                   tr_type.value == TransferType.GiftIn.value:
+        with open(filename, 'w', encoding='utf-8', newline='') as csvf:
+            csv.writer(csvf, quoting=csv.QUOTE_ALL, lineterminator='\n').writerows(rows)
 
-                    # Buy
-                    line += '\"' + str(amount) + '\",\"' + cur + '\",'
-
-                    # Sell
-                    line += r'"","",'
-
-                else:
-                    # Buy
-                    line += r'"","",'
+        print('Writing CSV ' + filename + ' finished.')
 
-                    # Sell
-                    line += '\"' + str(amount) + '\",\"' + cur + '\",'
 
-                # ToDo: Fee
-                line += r'"","",'
+def _export_csv(exporter: TronTransferExporter, filename: str, start_date: str = None, end_date: str = None):
+    """Exports the transfers of one exporter. Used as picklable worker function of export_all()."""
+    exporter.export_csv(filename, start_date=start_date, end_date=end_date)
 
-                # Exchange
-                line += '\"' + ('' if self.wallet_name is None else self.wallet_name) + '\",'
 
-                # Group
-                line += r'"",'
+def export_all(exporters: [TronTransferExporter], filenames: [str],
+               start_date: str = None, end_date: str = None, max_workers: int = None):
+    """
+    Exports the transfers of multiple wallets in parallel processes. Dates are handled in UTC like in export_csv().
+    The status messages of the processes are printed interleaved to the same output.
+    They name the wallet or the destination file, the download progress in percent does not.
 
-                # Comment
-                line += '\"' + tr.comment + '\",'
+    Arguments:
+        exporters {[TronTransferExporter]} -- Exporters of the wallets.
+        filenames {[str]} -- Destination file of each exporter.
 
-                # Date
-                line += '\"' + tr.get_date()
+    Keyword Arguments:
+        start_date {str} -- Exports all transfers from including this date (UTC). Format: "yyyy-mm-dd hh:mm:ss" (default: {None})
+        end_date {str} -- Exports all transfers up to and including this date (UTC). Format: "yyyy-mm-dd hh:mm:ss" (default: {None})
+        max_workers {int} -- Maximum number of processes. None for the number of processors. (default: {None})
+    """
 
-                csvf.write(line)
+    export = functools.partial(_export_csv, start_date=start_date, end_date=end_date)
 
-        print('Writing CSV finished.')
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(export, exporters, filenames))
@@ -1,5 +1,6 @@
 import json
 import pytz
+import sys
 from enum import Enum 
 from datetime import datetime
 
@@ -17,42 +18,80 @@ class ContractType(Enum):
         Freeze = 11
         Unfreeze = 12
 
+_timezones = {}
+
+def _get_timezone(timezone):
+    """Returns the tzinfo of a timezone. Looked up timezones are cached.
+    
+    Arguments:
+        timezone {str|tzinfo} -- Name of the timezone or tzinfo.
+    
+    Returns:
+        tzinfo -- Timezone.
+    """
+
+    if not isinstance(timezone, str):
+        return timezone
+
+    tz = _timezones.get(timezone)
+    if tz is None:
+        tz = _timezones[timezone] = pytz.timezone(timezone)
+    return tz
+
 class TronTransfer(object):
     """Class of a transfer in the Tron Network."""
 
-    def __init__(self, transfer_dict = None):
+    __slots__ = ('id', 'block', 'transaction_hash', 'timestamp', 'from_address', 'to_address',
+                 'amount', 'token_name', 'confirmed', 'data', 'comment')
+
+    def __init__(self, transfer_dict = None, timestamp = None, from_address = None, to_address = None,
+                 amount = None, token_name = None, confirmed = None, comment = ''):
+        """Creates a transfer from the dict of the tronscan api. Without dict, the transfer is created from the keyword arguments.
+        
+        Keyword Arguments:
+            transfer_dict {dict} -- Transfer of the tronscan api. (default: {None})
+            timestamp {int} -- Timestamp in milliseconds. (default: {None})
+            from_address {str} -- Sender address. (default: {None})
+            to_address {str} -- Destination address. (default: {None})
+            amount {int} -- Amount in the smallest unit of the token. (default: {None})
+            token_name {str} -- Name of the token. (default: {None})
+            confirmed {bool} -- Confirmation status. (default: {None})
+            comment {str} -- Comment. (default: {''})
+        """
+
         if transfer_dict is None:
             self.id = None
             self.block = None
             self.transaction_hash = None
-            self.timestamp = None
-            self.from_address = None
-            self.to_address = None
-            self.amount = None
-            self.token_name = None
-            self.confirmed = None
+            self.timestamp = timestamp
+            self.from_address = from_address
+            self.to_address = to_address
+            self.amount = amount
+            self.token_name = token_name
+            self.confirmed = confirmed
             self.data = None
+            self.comment = comment
         else:
             self.id = transfer_dict['id']
             self.block = int(transfer_dict['block'])
             self.transaction_hash = transfer_dict['transactionHash']
             self.timestamp = int(transfer_dict['timestamp'])
-            self.from_address = transfer_dict['transferFromAddress']
-            self.to_address = transfer_dict['transferToAddress']
+            # Addresses are interned, so that comparisons are mostly identity checks
+            self.from_address = sys.intern(transfer_dict['transferFromAddress'])
+            self.to_address = sys.intern(transfer_dict['transferToAddress'])
             self.amount = int(transfer_dict['amount'])
             self.token_name = str(transfer_dict['tokenName'])
             self.confirmed = transfer_dict['confirmed']
             if not self.confirmed:
                 print("Warning: Transfer " + self.id + " is not confirmed!")
             self.data = transfer_dict['data']
-
-        self.comment = ''
+            self.comment = ''
 
     def get_date(self, timezone = None, date_format = '%Y-%m-%d %H:%M:%S'):
         """Converts the timestamp of transfer in a date.
         
         Keyword Arguments:
-            timezone {str} -- Timezone. (default: {None})
+            timezone {str|tzinfo} -- Timezone. (default: {None})
             date_format {str} -- Format of the date. (default: {'%Y-%m-%d %H:%M:%S'})
         
         Returns:
@@ -63,8 +102,7 @@ class TronTransfer(object):
         if timezone is None:
             dt = datetime.fromtimestamp(ts)
         else:
-            tz = pytz.timezone(timezone)
-            dt = datetime.fromtimestamp(ts, tz)
+            dt = datetime.fromtimestamp(ts, _get_timezone(timezone))
         
         return dt.strftime(date_format)
 
@@ -111,7 +149,7 @@ class TronTransaction(object):
         """Converts the timestamp of transaction in a date.
         
         Keyword Arguments:
-            timezone {str} -- Timezone. (default: {'Europe/Berlin'})
+            timezone {str|tzinfo} -- Timezone. (default: {None})
             date_format {str} -- Format of the date. (default: {'%Y-%m-%d %H:%M:%S'})
         
         Returns:
@@ -122,8 +160,7 @@ class TronTransaction(object):
         if timezone is None:
             dt = datetime.fromtimestamp(ts)
         else:
-            tz = pytz.timezone(timezone)
-            dt = datetime.fromtimestamp(ts, tz)
+            dt = datetime.fromtimestamp(ts, _get_timezone(timezone))
         
         return dt.strftime(date_format)
 